@@ -2,7 +2,7 @@
 """
 Notion Backup Automation Script
 
-This script backs up specified Notion databases to CSV format.
+This script backs up specified Notion databases to gzip-compressed CSV format.
 Designed to run via GitHub Actions with scheduled workflows.
 
 Author: Rick Garnett
@@ -12,26 +12,74 @@ Created: January 2026
 import os
 import sys
 import csv
+import gzip
+import io
+import json
 import logging
-from datetime import datetime
+import queue
+import random
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import List, Dict, Any
+from itertools import chain, islice
+from typing import List, Dict, Any, BinaryIO, Callable, Iterable, Iterator, Optional
 
 try:
+    import httpx
     from notion_client import Client
+    from notion_client.errors import HTTPResponseError
     from dotenv import load_dotenv
 except ImportError as e:
     print(f"Error: Missing required package. Run: pip install -r requirements.txt")
     print(f"Details: {e}")
     sys.exit(1)
 
+# orjson is optional: it speeds up decoding of large API responses
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# HTTP/2 is optional: httpx only supports it when the h2 package is installed
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 # Configure logging
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+class _BufferedFileHandler(logging.FileHandler):
+    """FileHandler that lets the file buffer batch writes.
+    
+    Unlike FileHandler, records below ERROR are not flushed one by one;
+    logging.shutdown() flushes whatever is buffered at exit.
+    """
+    
+    def emit(self, record: logging.LogRecord):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            if record.levelno >= logging.ERROR:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
+    format=LOG_FORMAT,
     handlers=[
         logging.StreamHandler(sys.stdout),
-        logging.FileHandler('backup.log', mode='a')
+        _BufferedFileHandler('backup.log', mode='a')
     ]
 )
 logger = logging.getLogger(__name__)
@@ -44,6 +92,94 @@ NOTION_TOKEN = os.getenv('NOTION_TOKEN')
 CAPTAINS_LOG_DB_ID = os.getenv('CAPTAINS_LOG_DB_ID')
 PROJECTS_TRACKER_DB_ID = os.getenv('PROJECTS_TRACKER_DB_ID')
 BACKUP_DIR = Path('backups')
+MAX_BACKUP_WORKERS = 8
+PREFETCH_BATCHES = 2
+CSV_WRITE_BUFFER_SIZE = 1 << 20  # 1 MiB
+GZIP_COMPRESS_LEVEL = 6  # Good throughput/ratio balance; use 1 if CPU-bound
+CSV_CHUNK_ROWS = 5000
+MAX_COMPRESS_WORKERS = 4
+NOTION_VERSION = '2022-06-28'
+NOTION_PAGE_SIZE = 100  # Maximum allowed by databases.query
+BACKUP_STATE_KEYS = ('database_last_edited_time', 'started_at', 'backup_file')
+MAX_CONCURRENT_REQUESTS = 4  # In-flight API calls across all threads
+MAX_RETRIES = 5
+MAX_RETRY_BACKOFF = 60  # seconds
+RETRYABLE_STATUSES = (429, 502, 503, 504)
+
+# Shared read-only stand-in for properties missing from a page
+_EMPTY: Dict[str, Any] = {}
+
+
+def _extract_select(prop: Dict[str, Any]) -> str:
+    select = prop.get('select')
+    return select.get('name', '') if select else ''
+
+
+def _extract_date(prop: Dict[str, Any]) -> str:
+    date = prop.get('date')
+    if date:
+        start = date.get('start', '')
+        end = date.get('end')
+        return f"{start} - {end}" if end else start
+    return ''
+
+
+def _extract_status(prop: Dict[str, Any]) -> str:
+    status = prop.get('status')
+    return status.get('name', '') if status else ''
+
+
+@contextmanager
+def _atomic_output(filepath: Path) -> Iterator[Path]:
+    """Yield a temporary path that replaces filepath only on success.
+    
+    Readers never see a partially written file: the temporary file is
+    renamed into place with os.replace, or removed if writing fails.
+    """
+    tmppath = filepath.with_name(f"{filepath.name}.tmp")
+    try:
+        yield tmppath
+        os.replace(tmppath, filepath)
+    finally:
+        if tmppath.exists():
+            tmppath.unlink()
+
+
+def _decode_json_with_orjson(response: httpx.Response) -> None:
+    """Response hook that parses the response body with orjson."""
+    response.json = lambda **kwargs: orjson.loads(response.content)
+
+
+def _plain_field(key: str) -> Callable[[Dict[str, Any]], str]:
+    """Build an extractor for properties whose value is already a string."""
+    return lambda p: p.get(key) or ''
+
+
+# Property value extractors keyed by Notion property type
+_HANDLERS: Dict[str, Callable[[Dict[str, Any]], str]] = {
+    'title': lambda p: ' '.join(t.get('plain_text', '') for t in p.get('title') or ()),
+    'rich_text': lambda p: ' '.join(t.get('plain_text', '') for t in p.get('rich_text') or ()),
+    'number': lambda p: str(p.get('number', '')),
+    'select': _extract_select,
+    'multi_select': lambda p: ', '.join(s.get('name', '') for s in p.get('multi_select') or ()),
+    'date': _extract_date,
+    'checkbox': lambda p: 'Yes' if p.get('checkbox') else 'No',
+    'url': _plain_field('url'),
+    'email': _plain_field('email'),
+    'phone_number': _plain_field('phone_number'),
+    'status': _extract_status,
+    'people': lambda p: ', '.join(u.get('name', '') for u in p.get('people') or ()),
+    'files': lambda p: ', '.join(f.get('name', '') for f in p.get('files') or ()),
+    'relation': lambda p: f"{len(p.get('relation', []))} relations",
+    'created_time': _plain_field('created_time'),
+    'last_edited_time': _plain_field('last_edited_time'),
+}
+
+# Types whose handlers only read top-level fields and cannot raise
+_UNGUARDED_TYPES = frozenset({
+    'number', 'checkbox', 'url', 'email', 'phone_number',
+    'created_time', 'last_edited_time',
+})
 
 
 class NotionBackup:
@@ -58,149 +194,357 @@ class NotionBackup:
         if not token:
             raise ValueError("Notion token is required")
         
-        self.client = Client(auth=token)
+        # Share one pooled HTTP client so connections are reused across requests
+        response_hooks = [_decode_json_with_orjson] if orjson else []
+        http_client = httpx.Client(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_keepalive_connections=MAX_BACKUP_WORKERS),
+            event_hooks={'response': response_hooks}
+        )
+        self.client = Client(
+            auth=token,
+            notion_version=NOTION_VERSION,
+            client=http_client
+        )
+        self.request_slots = threading.Semaphore(MAX_CONCURRENT_REQUESTS)
         self.backup_dir = BACKUP_DIR
         self.backup_dir.mkdir(exist_ok=True)
         logger.info("Notion client initialized successfully")
     
-    def get_database_pages(self, database_id: str) -> List[Dict[str, Any]]:
-        """Retrieve all pages from a Notion database.
+    def call_api(self, method: Callable[..., Any], **kwargs: Any) -> Any:
+        """Call a Notion API method, retrying rate limits and transient errors.
+        
+        Retries up to MAX_RETRIES times with exponential backoff, honoring
+        the Retry-After header when Notion sends one.
         
         Args:
-            database_id: The Notion database ID
+            method: Notion client endpoint method, e.g. client.databases.query
+            **kwargs: Arguments passed to the method
             
         Returns:
-            List of page objects
+            The API response
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                with self.request_slots:
+                    return method(**kwargs)
+            except HTTPResponseError as e:
+                if e.status not in RETRYABLE_STATUSES or attempt == MAX_RETRIES:
+                    raise
+                
+                try:
+                    retry_after = float(e.headers.get('Retry-After'))
+                    backoff = max(0.0, min(MAX_RETRY_BACKOFF, retry_after))
+                except (TypeError, ValueError):
+                    backoff = min(MAX_RETRY_BACKOFF, 2 ** attempt + random.random())
+                
+                logger.warning(
+                    f"Notion API returned {e.status}; retrying in {backoff:.1f}s "
+                    f"(attempt {attempt + 1}/{MAX_RETRIES})"
+                )
+                time.sleep(backoff)
+    
+    def iter_database_batches(self, database_id: str) -> Iterator[List[Dict[str, Any]]]:
+        """Retrieve pages from a Notion database one API response at a time.
+        
+        Args:
+            database_id: The Notion database ID
+            
+        Yields:
+            Lists of page objects, one per query response
         """
         logger.info(f"Fetching pages from database: {database_id}")
-        pages = []
+        page_count = 0
         has_more = True
         start_cursor = None
         
         try:
             while has_more:
-                response = self.client.databases.query(
+                response = self.call_api(
+                    self.client.databases.query,
                     database_id=database_id,
-                    start_cursor=start_cursor
+                    start_cursor=start_cursor,
+                    page_size=NOTION_PAGE_SIZE
                 )
-                pages.extend(response.get('results', []))
+                results = response.get('results', [])
+                page_count += len(results)
+                yield results
                 has_more = response.get('has_more', False)
                 start_cursor = response.get('next_cursor')
                 
-            logger.info(f"Retrieved {len(pages)} pages")
-            return pages
+            logger.info(f"Retrieved {page_count} pages")
             
         except Exception as e:
             logger.error(f"Error fetching database pages: {e}")
             raise
     
-    def extract_property_value(self, prop: Dict[str, Any]) -> str:
-        """Extract value from Notion property based on its type.
+    def prefetch_database_batches(self, database_id: str) -> Iterator[List[Dict[str, Any]]]:
+        """Fetch page batches in a background thread while the caller consumes them.
+        
+        Overlaps the next API round trip with processing of the current
+        batch. At most PREFETCH_BATCHES batches are held in memory.
         
         Args:
-            prop: Notion property object
+            database_id: The Notion database ID
             
-        Returns:
-            Formatted string value
+        Yields:
+            Lists of page objects, one per query response
         """
-        prop_type = prop.get('type')
+        batches = queue.Queue(maxsize=PREFETCH_BATCHES)
+        stop = threading.Event()
+        
+        def produce():
+            try:
+                for batch in self.iter_database_batches(database_id):
+                    if stop.is_set():
+                        return
+                    batches.put(batch)
+            except Exception as e:
+                batches.put(e)
+            else:
+                batches.put(None)
+        
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
         
         try:
-            if prop_type == 'title':
-                return ' '.join([t.get('plain_text', '') for t in prop.get('title', [])])
-            elif prop_type == 'rich_text':
-                return ' '.join([t.get('plain_text', '') for t in prop.get('rich_text', [])])
-            elif prop_type == 'number':
-                return str(prop.get('number', ''))
-            elif prop_type == 'select':
-                select = prop.get('select')
-                return select.get('name', '') if select else ''
-            elif prop_type == 'multi_select':
-                return ', '.join([s.get('name', '') for s in prop.get('multi_select', [])])
-            elif prop_type == 'date':
-                date = prop.get('date')
-                if date:
-                    start = date.get('start', '')
-                    end = date.get('end')
-                    return f"{start} - {end}" if end else start
+            while True:
+                item = batches.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Unblock the producer if the consumer stopped early
+            stop.set()
+            while True:
+                try:
+                    batches.get_nowait()
+                except queue.Empty:
+                    break
+            producer.join()
+    
+    def load_backup_state(self, database_name: str) -> Dict[str, Any]:
+        """Load the state recorded by the previous backup of a database.
+        
+        Args:
+            database_name: Name used for the backup files
+            
+        Returns:
+            Saved state, or an empty dict if there is none or it is invalid
+        """
+        state_path = self.backup_dir / f"{database_name}.state.json"
+        try:
+            state = json.loads(state_path.read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable backup state {state_path}: {e}")
+            return {}
+        
+        if not isinstance(state, dict) or not all(
+            isinstance(state.get(key), str) for key in BACKUP_STATE_KEYS
+        ):
+            logger.warning(f"Ignoring invalid backup state {state_path}")
+            return {}
+        if Path(state['backup_file']).name != state['backup_file']:
+            logger.warning(f"Ignoring backup state {state_path}: bad backup_file")
+            return {}
+        
+        return state
+    
+    def save_backup_state(self, database_name: str, state: Dict[str, Any]):
+        """Record state for the next incremental backup check.
+        
+        Args:
+            database_name: Name used for the backup files
+            state: State to save
+        """
+        state_path = self.backup_dir / f"{database_name}.state.json"
+        with _atomic_output(state_path) as tmppath:
+            tmppath.write_text(json.dumps(state, indent=2), encoding='utf-8')
+    
+    def find_unchanged_backup(self, database_id: str, schema: Dict[str, Any],
+                              state: Dict[str, Any]) -> Optional[Path]:
+        """Find the previous backup if the database has not changed since.
+        
+        The database must have the same last_edited_time as before, and no
+        page may have been edited since the previous export started. Pages
+        deleted since then are not detected, because the query does not
+        return archived pages.
+        
+        Args:
+            database_id: The Notion database ID
+            schema: Database object from databases.retrieve
+            state: State saved by the previous backup
+            
+        Returns:
+            Path to the previous backup file, or None if a full export is needed
+        """
+        backup_file = state.get('backup_file')
+        started_at = state.get('started_at')
+        if not backup_file or not started_at:
+            return None
+        if not (self.backup_dir / backup_file).exists():
+            return None
+        if schema.get('last_edited_time') != state.get('database_last_edited_time'):
+            return None
+        
+        response = self.call_api(
+            self.client.databases.query,
+            database_id=database_id,
+            page_size=1,
+            filter={
+                'timestamp': 'last_edited_time',
+                'last_edited_time': {'on_or_after': started_at}
+            }
+        )
+        if response.get('results'):
+            return None
+        
+        return self.backup_dir / backup_file
+    
+    def get_property_extractor(self, prop_type: str) -> Callable[[Dict[str, Any]], str]:
+        """Build an extractor for every value of one property type.
+        
+        Lets a column resolve its handler once instead of per cell.
+        
+        Args:
+            prop_type: Notion property type from the database schema
+            
+        Returns:
+            Function mapping a property object to a formatted string value
+        """
+        handler = _HANDLERS.get(prop_type)
+        if handler is None:
+            return str
+        if prop_type in _UNGUARDED_TYPES:
+            return handler
+        
+        # Handlers that dereference nested objects can fail on malformed data
+        def extract(prop: Dict[str, Any]) -> str:
+            try:
+                return handler(prop)
+            except Exception as e:
+                logger.warning(f"Error extracting property type '{prop_type}': {e}")
                 return ''
-            elif prop_type == 'checkbox':
-                return 'Yes' if prop.get('checkbox') else 'No'
-            elif prop_type == 'url':
-                return prop.get('url', '')
-            elif prop_type == 'email':
-                return prop.get('email', '')
-            elif prop_type == 'phone_number':
-                return prop.get('phone_number', '')
-            elif prop_type == 'status':
-                status = prop.get('status')
-                return status.get('name', '') if status else ''
-            elif prop_type == 'people':
-                return ', '.join([p.get('name', '') for p in prop.get('people', [])])
-            elif prop_type == 'files':
-                return ', '.join([f.get('name', '') for f in prop.get('files', [])])
-            elif prop_type == 'relation':
-                return f"{len(prop.get('relation', []))} relations"
-            elif prop_type == 'created_time':
-                return prop.get('created_time', '')
-            elif prop_type == 'last_edited_time':
-                return prop.get('last_edited_time', '')
-            else:
-                return str(prop)
-        except Exception as e:
-            logger.warning(f"Error extracting property type '{prop_type}': {e}")
-            return ''
+        
+        return extract
+    
+    def write_compressed_csv(self, rawfile: BinaryIO, rows: Iterable[List[str]]):
+        """Write rows as gzip-compressed CSV, compressing chunks in parallel.
+        
+        Rows are formatted in chunks of CSV_CHUNK_ROWS and each chunk is
+        compressed into its own gzip member on a worker thread, overlapping
+        compression with formatting of the next chunk. Concatenated gzip
+        members decompress as one file.
+        
+        Args:
+            rawfile: Binary file to write the compressed output to
+            rows: CSV rows, including the header row
+        """
+        rows = iter(rows)
+        pending = deque()
+        
+        with ThreadPoolExecutor(max_workers=MAX_COMPRESS_WORKERS) as executor:
+            for chunk in iter(lambda: list(islice(rows, CSV_CHUNK_ROWS)), []):
+                buffer = io.StringIO(newline='')
+                csv.writer(buffer).writerows(chunk)
+                data = buffer.getvalue().encode('utf-8')
+                pending.append(executor.submit(gzip.compress, data, GZIP_COMPRESS_LEVEL))
+                
+                # Write finished chunks in order, bounding how many are in memory
+                while len(pending) > MAX_COMPRESS_WORKERS:
+                    rawfile.write(pending.popleft().result())
+            
+            while pending:
+                rawfile.write(pending.popleft().result())
     
     def export_to_csv(self, database_id: str, database_name: str) -> Path:
-        """Export Notion database to CSV file.
+        """Export Notion database to a gzip-compressed CSV file.
         
         Args:
             database_id: The Notion database ID
             database_name: Name for the backup file
             
         Returns:
-            Path to created CSV file
+            Path to created .csv.gz file
         """
         logger.info(f"Starting export of '{database_name}'")
         
         try:
-            # Get all pages
-            pages = self.get_database_pages(database_id)
-            
-            if not pages:
-                logger.warning(f"No pages found in database '{database_name}'")
-                return None
-            
-            # Extract headers from first page
-            headers = ['ID', 'Created', 'Last Edited']
-            properties = pages[0].get('properties', {})
-            headers.extend(properties.keys())
+            # Headers come from the database schema, not individual pages
+            schema = self.call_api(self.client.databases.retrieve, database_id=database_id)
+            schema_properties = schema.get('properties', {})
+            prop_names = list(schema_properties.keys())
+            headers = ['ID', 'Created', 'Last Edited'] + prop_names
             
             # Generate filename with timestamp
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{database_name}_{timestamp}.csv"
+            filename = f"{database_name}_{timestamp}.csv.gz"
             filepath = self.backup_dir / filename
             
-            # Write to CSV
-            with open(filepath, 'w', newline='', encoding='utf-8') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(headers)
+            # Reuse the previous backup if nothing has changed since
+            state = self.load_backup_state(database_name)
+            previous = self.find_unchanged_backup(database_id, schema, state)
+            if previous:
+                with _atomic_output(filepath) as tmppath:
+                    shutil.copyfile(previous, tmppath)
+                self.save_backup_state(database_name, {**state, 'backup_file': filename})
+                logger.info(f"✓ No changes since {previous.name}; copied to {filepath}")
+                return filepath
+            
+            # Notion rounds last_edited_time down to the minute, so step back a
+            # full minute to catch edits made during this export and clock skew
+            started_at = (
+                datetime.now(timezone.utc) - timedelta(minutes=1)
+            ).replace(second=0, microsecond=0).isoformat()
+            
+            # Fetch pages in the background while rows are written
+            batches = self.prefetch_database_batches(database_id)
+            
+            try:
+                pages = chain.from_iterable(batches)
+                first_page = next(pages, None)
+                
+                if first_page is None:
+                    logger.warning(f"No pages found in database '{database_name}'")
+                    return None
+                
+                # Every page shares the schema, so pick each column's extractor once
+                columns = [
+                    (name, self.get_property_extractor(prop.get('type')))
+                    for name, prop in schema_properties.items()
+                ]
                 
-                for page in pages:
-                    row = [
+                page_count = 0
+                
+                def to_row(page: Dict[str, Any]) -> List[str]:
+                    nonlocal page_count
+                    page_count += 1
+                    props = page.get('properties') or _EMPTY
+                    return [
                         page.get('id', ''),
                         page.get('created_time', ''),
                         page.get('last_edited_time', '')
-                    ]
-                    
-                    for prop_name in properties.keys():
-                        prop = page.get('properties', {}).get(prop_name, {})
-                        value = self.extract_property_value(prop)
-                        row.append(value)
-                    
-                    writer.writerow(row)
+                    ] + [extract(props.get(name, _EMPTY)) for name, extract in columns]
+                
+                # Write gzipped CSV, streaming pages as they arrive
+                rows = map(to_row, chain([first_page], pages))
+                with _atomic_output(filepath) as tmppath:
+                    with open(tmppath, 'wb', buffering=CSV_WRITE_BUFFER_SIZE) as rawfile:
+                        self.write_compressed_csv(rawfile, chain([headers], rows))
+            finally:
+                batches.close()
+            
+            self.save_backup_state(database_name, {
+                'database_last_edited_time': schema.get('last_edited_time'),
+                'started_at': started_at,
+                'backup_file': filename
+            })
             
-            logger.info(f"✓ Successfully exported {len(pages)} pages to {filepath}")
+            logger.info(f"✓ Successfully exported {page_count} pages to {filepath}")
             return filepath
             
         except Exception as e:
@@ -219,20 +563,33 @@ class NotionBackup:
         backup_files = []
         errors = []
         
+        pending = {}
         for name, db_id in databases.items():
-            try:
-                if not db_id:
-                    logger.warning(f"Skipping '{name}': No database ID provided")
-                    continue
+            if not db_id:
+                logger.warning(f"Skipping '{name}': No database ID provided")
+                continue
+            pending[name] = db_id
+        
+        if pending:
+            # Exports are network-bound, so run them concurrently
+            max_workers = min(MAX_BACKUP_WORKERS, len(pending))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(self.export_to_csv, db_id, name): name
+                    for name, db_id in pending.items()
+                }
                 
-                filepath = self.export_to_csv(db_id, name)
-                if filepath:
-                    backup_files.append(filepath)
-                    
-            except Exception as e:
-                error_msg = f"Failed to backup '{name}': {e}"
-                logger.error(error_msg)
-                errors.append(error_msg)
+                for future in as_completed(futures):
+                    name = futures[future]
+                    try:
+                        filepath = future.result()
+                        if filepath:
+                            backup_files.append(filepath)
+                            
+                    except Exception as e:
+                        error_msg = f"Failed to backup '{name}': {e}"
+                        logger.error(error_msg)
+                        errors.append(error_msg)
         
         # Summary
         logger.info(f"\n{'='*60}")
@@ -0,0 +1,49 @@
+"""Tests for backup_notion.py."""
+
+import csv
+import gzip
+import importlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+
+class WriteCompressedCsvTest(unittest.TestCase):
+    """Round-trip checks for the chunked gzip CSV writer."""
+    
+    def setUp(self):
+        # backup_notion creates backup.log and backups/ in the working directory
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir.name)
+        sys.path.insert(0, str(REPO_ROOT))
+        self.module = importlib.import_module('backup_notion')
+        self.backup = self.module.NotionBackup('test-token')
+    
+    def tearDown(self):
+        sys.path.remove(str(REPO_ROOT))
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+    
+    def test_round_trip_across_chunk_boundaries(self):
+        chunk_rows = self.module.CSV_CHUNK_ROWS
+        rows = [['ID', 'Name', 'Notes']] + [
+            [f'page-{i}', f'Name {i}', 'line one\nline two, "quoted"']
+            for i in range(2 * chunk_rows + 123)
+        ]
+        
+        rawfile = io.BytesIO()
+        self.backup.write_compressed_csv(rawfile, iter(rows))
+        rawfile.seek(0)
+        
+        with gzip.open(rawfile, 'rt', newline='', encoding='utf-8') as csvfile:
+            self.assertEqual(list(csv.reader(csvfile)), rows)
+
+
+if __name__ == '__main__':
+    unittest.main()